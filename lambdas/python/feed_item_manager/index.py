@@ -1,246 +1,117 @@
 """ Lambda function to fetch feed items """
-# pylint: disable=unused-argument
+# pylint: disable=unused-argument, import-error
 
 from datetime import datetime
-import os
-import json
 
+from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from aws_lambda_powertools.utilities.data_classes.dynamo_db_stream_event import (
-    DynamoDBStreamEvent,
-    DynamoDBRecordEventName,
-)
-from aws_lambda_powertools.utilities.parser.pydantic import (
-    ValidationError as PydanticValidationError,
-)
-import boto3
-from botocore.exceptions import ClientError
-import feedparser
-
-# Initialize DynamoDB client
-dynamodb = boto3.resource("dynamodb")
-dynamodb_client = boto3.client("dynamodb")
-sqs = boto3.resource("sqs")
-
-TABLE_NAME = os.environ["TABLE_NAME"]
-QUEUE_URL = os.environ["QUEUE_URL"]
-
-feed_table = dynamodb.Table(TABLE_NAME)
-
-
-class FeedValidationError(Exception):
-    """Raised when feed validation fails"""
-
-
-def prepare_item(key_type, value):
-    """Prepare an item for DynamoDB"""
-    if key_type == "S" and value:
-        return {key_type: str(value)}
-    if key_type == "N" and value is not None:
-        return {key_type: str(value)}
-    if key_type == "BOOL":
-        return {key_type: bool(value)}
-    if key_type == "SS" and value:
-        return {key_type: value}
-    return None
-
-
-def chunk(items, batch_size):
-    """Yield successive batch_size-sized chunks from items."""
-    for i in range(0, len(items), batch_size):
-        yield items[i : i + batch_size]
-
-
-def update_feed_on_success(feed_id: str, current_time: str):
-    """Reset error_count and last_error_message on successful update, and update last_polled"""
-    dynamodb_client.update_item(
-        TableName=TABLE_NAME,
-        Key={"PK": {"S": f"FEED#{feed_id}"}, "SK": {"S": f"META#{feed_id}"}},
-        UpdateExpression="SET error_count = :zero, last_error_message = :empty_str, last_polled = :current_time",
-        ExpressionAttributeValues={
-            ":zero": {"N": "0"},
-            ":empty_str": {"S": ""},
-            ":current_time": {"S": current_time},
-        },
-    )
 
+from feed_common import (
+    FEED_PREFIX,
+    META_PREFIX,
+    feed_message_body,
+    fetch_feeds,
+    get_cache_validators,
+    json_dumps,
+    json_loads,
+    parse_entries,
+    send_feed_messages,
+    store_feed_items,
+    update_feed_on_error,
+    update_feed_on_success,
+)
 
-def update_feed_on_error(feed_id: str, error_message: str, current_time: str):
-    """Increment error_count, set last_error_message, and update last_polled on update error"""
-    dynamodb_client.update_item(
-        TableName=TABLE_NAME,
-        Key={"PK": {"S": f"FEED#{feed_id}"}, "SK": {"S": f"META#{feed_id}"}},
-        UpdateExpression="ADD error_count :one SET last_error_message = :error_msg, last_polled = :current_time",
-        ExpressionAttributeValues={
-            ":one": {"N": "1"},
-            ":error_msg": {"S": error_message},
-            ":current_time": {"S": current_time},
-        },
-    )
+logger = Logger()
 
 
-def store_feed_items(feed_id: str, feed_data: feedparser.FeedParserDict):
-    """Store feed items in DynamoDB"""
+class FeedQueueError(Exception):
+    """Raised when feeds can't be queued for fetching"""
 
-    feed_items = []
-    items_to_check_keys = []
 
-    for entry in feed_data.entries:
-        item_pk = {"S": f"FEED#{feed_id}"}
+def stream_handler(event: dict, context: LambdaContext):
+    """Lambda handler to queue newly added feeds for fetching their items"""
 
-        if "guid" in entry:
-            item_sk = {"S": f"ITEM#{entry.guid}"}
-        elif "id" in entry:
-            item_sk = {"S": f"ITEM#{entry.id}"}
-        elif "link" in entry:
-            item_sk = {"S": f"ITEM#{entry.link}"}
-        else:
+    # Multiple records can be delivered in a single event, read as raw dicts.
+    # Only the insert of a feed's META# row is of interest.
+    messages = []
+    for record in event["Records"]:
+        if record["eventName"] != "INSERT":
             continue
 
-        # Extract categories or tags
-        categories = list({tag.term for tag in entry.get("tags", [])})
-
-        # Extract comments link
-        comments_link = entry.get("comments", None)
-        if not comments_link:
-            comments_links = [
-                link.href for link in entry.get("links", []) if link.rel == "replies"
-            ]
-            comments_link = comments_links[0] if comments_links else None
-
-        item_data = {
-            "title": prepare_item("S", entry.get("title")),
-            "link": prepare_item("S", entry.get("link")),
-            "description": prepare_item("S", entry.get("description")),
-            "author": prepare_item("S", entry.get("author")),
-            "published": prepare_item("S", entry.get("published")),
-            "updated": prepare_item("S", entry.get("updated")),
-            "content": prepare_item("S", entry.get("content")),
-            "categories": prepare_item("SS", categories),
-            "comments_link": prepare_item("S", comments_link),
-        }
-
-        # Remove keys with empty dictionary values
-        item_data = {k: v for k, v in item_data.items() if v}
-
-        feed_item = {
-            "PK": item_pk,
-            "SK": item_sk,
-            **item_data,
-        }
-        feed_items.append(feed_item)
-
-        # Add the item to the list of items to check for keys
-        items_to_check_keys.append({"PK": item_pk, "SK": item_sk})
-
-    # Batch get existing feed items from DynamoDB for comparison using the client interface
-    fetched_items_dict = {}
-    batch_keys = [{"PK": key["PK"], "SK": key["SK"]} for key in items_to_check_keys]
-    response = dynamodb_client.batch_get_item(
-        RequestItems={TABLE_NAME: {"Keys": batch_keys}}
-    )
-
-    fetched_items = response["Responses"].get(TABLE_NAME, [])
-    for item in fetched_items:
-        fetched_items_dict[(item["PK"]["S"], item["SK"]["S"])] = item
-
-    print(f"existing items: {fetched_items_dict}")
-
-    # Filter items to only those that are new or have changed
-    items_to_write = []
-    for item in feed_items:
-        key = (item["PK"]["S"], item["SK"]["S"])
-        existing_item = fetched_items_dict.get(key, None)
-        if not existing_item or existing_item != item:
-            items_to_write.append(item)
-
-    print(f"Items to write: {items_to_write}")
-
-    # Batch write the new or changed items to DynamoDB using the client API
-    for batch in chunk(items_to_write, 25):  # DynamoDB allows up to 25 items in a batch
-        write_requests = [{"PutRequest": {"Item": item}} for item in batch]
-        dynamodb_client.batch_write_item(RequestItems={TABLE_NAME: write_requests})
+        keys = record["dynamodb"]["Keys"]
+        if not (
+            keys["PK"]["S"].startswith(FEED_PREFIX)
+            and keys["SK"]["S"].startswith(META_PREFIX)
+        ):
+            continue
 
+        new_image = record["dynamodb"]["NewImage"]
+        messages.append(
+            feed_message_body(new_image["feed_id"]["S"], new_image["feed_url"]["S"])
+        )
 
-def stream_handler(event: DynamoDBStreamEvent, context: LambdaContext):
-    """Lambda handler"""
-    event: DynamoDBStreamEvent = DynamoDBStreamEvent(event)
+    logger.debug(
+        "Stream batch of %d records, %d feeds to queue",
+        len(event["Records"]),
+        len(messages),
+    )
 
-    # Multiple records can be delivered in a single event
-    for record in event.records:
-        print(f"Event name: {record.event_name}")
-        if record.event_name == DynamoDBRecordEventName.INSERT:
-            primary_key = record.dynamodb.keys["PK"]
-            sort_key = record.dynamodb.keys["SK"]
-            if not (primary_key.startswith("FEED#") and sort_key.startswith("META#")):
-                continue
+    # Fetching is left to feed_message_handler so a slow feed can't hold up
+    # the stream shard
+    failed = send_feed_messages(messages)
+    if failed:
+        # Let the stream retry the batch, duplicate fetches are harmless
+        raise FeedQueueError(f"Failed to queue feeds: {failed}")
 
-            feed_id = record.dynamodb.new_image["PK"].split("#")[1]
-            feed_url = record.dynamodb.new_image["feed_url"]
-            feed_data = feedparser.parse(feed_url)
+    return {"statusCode": 200, "body": json_dumps({"message": "Success"})}
 
-            if feed_data.bozo:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"message": "Invalid feed URL"}),
-                }
 
-            current_time = datetime.now().isoformat()
+def feed_message_handler(event: dict, context: LambdaContext):
+    """Lambda handler to update feed items using SQS messages"""
 
-            # Extract necessary metadata from the parsed feed
-            try:
-                store_feed_items(feed_id, feed_data)
-                update_feed_on_success(feed_id, current_time)
-            except PydanticValidationError as exc:
-                update_feed_on_error(feed_id, str(exc), current_time)
-                raise FeedValidationError(exc.errors()) from exc
-
-            except ClientError as exc:
-                update_feed_on_error(feed_id, str(exc), current_time)
-                if exc.response["Error"]["Code"] == "TransactionCanceledException":
-                    # One of the conditions failed (likely the uniqueness check)
-                    return {
-                        "statusCode": 400,
-                        "body": json.dumps(
-                            {
-                                "message": f"A feed with URL {feed_url} already exists or another condition failed!"
-                            }
-                        ),
-                    }
-                print(exc)
-
-    return {"statusCode": 200, "body": json.dumps({"message": "Success"})}
+    # Parse the JSON message bodies and download all feeds of the batch at once,
+    # only transferring the feeds that changed since they were last polled
+    messages = [json_loads(record["body"]) for record in event["Records"]]
+    validators = get_cache_validators([message["feed_id"] for message in messages])
+    responses = fetch_feeds(
+        [message["feed_url"] for message in messages],
+        [validators.get(message["feed_id"], (None, None)) for message in messages],
+    )
 
+    # The whole batch was polled at once, so it shares the poll time
+    current_time = datetime.now().isoformat()
 
-def feed_message_handler(event: dict, context: LambdaContext):
-    """Lambda handler to update feed items using SQS messages"""
+    # Messages that aren't reported as failed are deleted by Lambda
+    failed = []
 
     # Process each message in the batch
-    for record in event["Records"]:
-        # Parse the JSON message body
-        message_data = json.loads(record["body"])
+    for record, message_data, response in zip(event["Records"], messages, responses):
         feed_id = message_data["feed_id"]
         feed_url = message_data["feed_url"]
 
-        # Fetch the feed data
-        feed_data = feedparser.parse(feed_url)
-        if feed_data.bozo:
-            print(f"Failed to fetch feed data for feed {feed_id} with URL {feed_url}")
-            continue
+        # A feed that can't be parsed or stored only fails its own message
+        try:
+            if response is not None and response.not_modified:
+                logger.debug("Feed %s not modified since last poll", feed_id)
+                update_feed_on_success(feed_id, current_time)
+                continue
 
-        current_time = datetime.now().isoformat()
+            entries = parse_entries(response.body if response else None)
+            if entries is None:
+                logger.warning(
+                    "Failed to fetch feed data for feed %s with URL %s",
+                    feed_id,
+                    feed_url,
+                )
+                continue
 
-        # Extract necessary metadata from the parsed feed
-        try:
-            store_feed_items(feed_id, feed_data)
-            update_feed_on_success(feed_id, current_time)
+            store_feed_items(feed_id, entries)
+            update_feed_on_success(
+                feed_id, current_time, response.etag, response.modified
+            )
         except Exception as exc:  # pylint: disable=broad-except
             update_feed_on_error(feed_id, str(exc), current_time)
-            print(
-                f"A feed with URL {feed_url} already exists or another condition failed!. Error: {exc}"
-            )
-            continue
+            logger.exception("Failed to process feed %s with URL %s", feed_id, feed_url)
+            failed.append({"itemIdentifier": record["messageId"]})
 
-        # Delete the message from the queue
-        message = sqs.Message(QUEUE_URL, record["receiptHandle"])
-        message.delete()
+    return {"batchItemFailures": failed}
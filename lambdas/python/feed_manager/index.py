@@ -1,12 +1,12 @@
 """ Lambda function to add a feed to the database"""
 # pylint: disable=unused-argument, import-error
 
-import os
-import json
+from collections import OrderedDict
+from itertools import chain
+import time
 import uuid
 
-import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 
 from aws_lambda_powertools import Logger, Tracer, Metrics
 from aws_lambda_powertools.event_handler import APIGatewayRestResolver
@@ -15,19 +15,74 @@ from aws_lambda_powertools.utilities.typing import LambdaContext
 from aws_lambda_powertools.utilities.parser.pydantic import (
     ValidationError as PydanticValidationError,
 )
-import feedparser
 
+from feed_common import (
+    DEFAULT_UPDATE_PERIOD,
+    FEED_PK,
+    META_SK,
+    TABLE_NAME,
+    UNIQUE_URL,
+    dynamodb_client,
+    fetch_feed,
+    json_dumps,
+    load_feedparser,
+    poll_shard,
+    polling_interval,
+)
 from models import CreateFeedInput, FeedStatus, Feed
 
 
 ITEMS_PER_PAGE = 20
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource("dynamodb")
-TABLE_NAME = os.environ["TABLE_NAME"]
-feed_table = dynamodb.Table(TABLE_NAME)
-
-dynamodb_client = boto3.client("dynamodb")
+# Bytes of a new feed's document read to extract its channel metadata
+FEED_HEAD_BYTES = 256 * 1024
+
+# Number of taken feed URLs remembered by a warm container
+SEEN_URLS_MAX = 1024
+
+# Attributes of the feed metadata item taken from the parsed feed, as
+# (name, DynamoDB type, getter(feed, feed_url)). Empty values are not stored.
+# feed is a plain dict, so the getters spell out the FeedParserDict aliases.
+FIELDS = (
+    ("feed_url", "S", lambda feed, feed_url: feed_url),
+    ("feed_atom_id", "S", lambda feed, feed_url: feed.get("id")),
+    ("feed_title", "S", lambda feed, feed_url: feed.get("title")),
+    ("feed_link", "S", lambda feed, feed_url: feed.get("link")),
+    (
+        "feed_description",
+        "S",
+        lambda feed, feed_url: feed.get("summary", feed.get("subtitle")),
+    ),
+    ("feed_author", "S", lambda feed, feed_url: feed.get("author")),
+    ("feed_language", "S", lambda feed, feed_url: feed.get("language")),
+    ("feed_pub_date", "S", lambda feed, feed_url: feed.get("pubDate")),
+    ("feed_last_build_date", "S", lambda feed, feed_url: feed.get("lastBuildDate")),
+    (
+        "feed_updated",
+        "S",
+        lambda feed, feed_url: feed.get("updated", feed.get("published")),
+    ),
+    ("feed_ttl", "S", lambda feed, feed_url: feed.get("ttl")),
+    ("feed_image", "S", lambda feed, feed_url: feed.get("image", {}).get("href")),
+    (
+        "update_period",
+        "S",
+        lambda feed, feed_url: feed.get("sy_updateperiod", DEFAULT_UPDATE_PERIOD),
+    ),
+    (
+        "update_frequency",
+        "S",
+        lambda feed, feed_url: feed.get("sy_updatefrequency", "1"),
+    ),
+    ("status", "S", lambda feed, feed_url: FeedStatus.ACTIVE.value),
+    ("error_count", "N", lambda feed, feed_url: 0),
+    # Categories or tags
+    (
+        "categories",
+        "SS",
+        lambda feed, feed_url: [tag.term for tag in feed.get("tags", [])],
+    ),
+)
 
 logger = Logger()
 tracer = Tracer()
@@ -35,6 +90,10 @@ metrics = Metrics()
 
 app = APIGatewayRestResolver()
 
+# Feed URLs known to be stored, least recently used first. Feeds are never
+# deleted, so a URL that was taken once stays taken.
+_seen_urls = OrderedDict()
+
 
 class InputValidationError(Exception):
     """Raised when input validation fails"""
@@ -65,107 +124,92 @@ def handle_invalid_input(exc: Exception):
     }
 
 
-def prepare_item(key_type, value):
-    """Prepare an item for DynamoDB"""
-    if key_type == "S" and value:
-        return {key_type: str(value)}
-    if key_type == "N" and value is not None:
-        return {key_type: str(value)}
-    if key_type == "BOOL":
-        return {key_type: bool(value)}
-    if key_type == "SS" and value:
-        return {key_type: value}
-    return None
-
-
-def store_feed_metadata(feed_url: str, feed_data: feedparser.FeedParserDict):
+def store_feed_metadata(feed_url: str, feed_data: dict):
     """Store feed metadata in DynamoDB"""
 
-    feed_id = str(uuid.uuid4())
+    feed_id = uuid.uuid4().hex
 
     # Construct the PK and SK for the actual feed
-    pk_value = {"S": f"FEED#{feed_id}"}
-    sk_value = {"S": f"META#{feed_id}"}
+    pk_value = {"S": FEED_PK(feed_id)}
+    sk_value = {"S": META_SK(feed_id)}
 
     # Construct the PK and SK for the uniqueness check
-    unique_pk = {"S": f"UNIQUE#FEED_URL#{feed_url}"}
-    unique_sk = {"S": f"UNIQUE#FEED_URL#{feed_url}"}
+    unique_pk = {"S": UNIQUE_URL(feed_url)}
+    unique_sk = {"S": UNIQUE_URL(feed_url)}
+
+    # A plain dict copy skips FeedParserDict's key mapping on every lookup
+    feed = dict(feed_data.feed)
+
+    # First WebSub hub and self links, found in a single pass
+    push_hub_url = push_topic_url = None
+    for link in feed.get("links", ()):
+        rel = link.get("rel")
+        if rel == "hub" and push_hub_url is None:
+            push_hub_url = link.href
+        elif rel == "self" and push_topic_url is None:
+            push_topic_url = link.href
+        if push_hub_url and push_topic_url:
+            break
+
+    # The feed is fetched right away by the stream handler, so it is next due
+    # one polling interval from now
+    poll_interval = polling_interval(
+        feed.get("sy_updateperiod", DEFAULT_UPDATE_PERIOD),
+        feed.get("sy_updatefrequency", "1"),
+    )
+
+    derived_fields = (
+        ("feed_id", "S", feed_id),
+        ("poll_shard", "N", poll_shard(feed_id)),
+        ("poll_interval", "N", poll_interval),
+        ("next_poll_ts", "N", int(time.time()) + poll_interval),
+        ("push_supported", "BOOL", bool(push_hub_url)),
+        ("push_hub_url", "S", push_hub_url),
+        ("push_topic_url", "S", push_topic_url),
+        ("version", "S", feed_data.version),
+    )
+
+    # Only keep the attributes that have a value
+    feed_item = {"PK": pk_value, "SK": sk_value}
+    for name, type_tag, value in chain(
+        ((name, type_tag, getter(feed, feed_url)) for name, type_tag, getter in FIELDS),
+        derived_fields,
+    ):
+        if value not in (None, "", []):
+            feed_item[name] = {
+                type_tag: str(value) if type_tag in ("S", "N") else value
+            }
 
-    hub_links = [
-        link for link in feed_data.feed.get("links", []) if link.get("rel") == "hub"
-    ]
-    topic_links = [
-        link for link in feed_data.feed.get("links", []) if link.get("rel") == "self"
-    ]
+    # Claim the URL first, a feed that already exists fails the condition
+    unique_item = {"PK": unique_pk, "SK": unique_sk}
+    dynamodb_client.put_item(
+        TableName=TABLE_NAME,
+        Item=unique_item,
+        ConditionExpression="attribute_not_exists(PK) AND attribute_not_exists(SK)",
+    )
 
-    push_hub_url = hub_links[0].href if hub_links else None
-    push_topic_url = topic_links[0].href if topic_links else None
-
-    push_supported = bool(push_hub_url)
-
-    # Extract categories or tags
-    categories = [tag.term for tag in feed_data.feed.get("tags", [])]
-
-    feed_image = feed_data.feed.get("image", {}).get("href")
-
-    feed_metadata = {
-        "feed_url": prepare_item("S", feed_url),
-        "feed_atom_id": prepare_item("S", feed_data.feed.get("id")),
-        "feed_title": prepare_item("S", feed_data.feed.get("title")),
-        "feed_link": prepare_item("S", feed_data.feed.get("link")),
-        "feed_description": prepare_item("S", feed_data.feed.get("description")),
-        "feed_author": prepare_item("S", feed_data.feed.get("author")),
-        "feed_language": prepare_item("S", feed_data.feed.get("language")),
-        "feed_pub_date": prepare_item("S", feed_data.feed.get("pubDate")),
-        "feed_last_build_date": prepare_item("S", feed_data.feed.get("lastBuildDate")),
-        "feed_updated": prepare_item("S", feed_data.feed.get("updated")),
-        "feed_ttl": prepare_item("S", feed_data.feed.get("ttl")),
-        "feed_image": prepare_item("S", feed_image),
-        "last_polled": prepare_item("S", ""),
-        "update_period": prepare_item(
-            "S", feed_data.feed.get("sy_updateperiod", "hourly")
-        ),
-        "update_frequency": prepare_item(
-            "S", feed_data.feed.get("sy_updatefrequency", "1")
-        ),
-        "status": prepare_item("S", FeedStatus.ACTIVE.value),
-        "error_count": prepare_item("N", 0),
-        "last_error_message": prepare_item("S", ""),
-        "push_supported": prepare_item("BOOL", push_supported),
-        "push_hub_url": prepare_item("S", push_hub_url),
-        "push_topic_url": prepare_item("S", push_topic_url),
-        "push_last_subscription": prepare_item("S", ""),
-        "categories": prepare_item("SS", categories),
-        "version": prepare_item("S", feed_data.version),
-    }
+    try:
+        dynamodb_client.put_item(TableName=TABLE_NAME, Item=feed_item)
+    except Exception:
+        # Release the URL so adding the feed can be retried, whatever failed
+        dynamodb_client.delete_item(TableName=TABLE_NAME, Key=unique_item)
+        raise
 
-    # Filter out None values
-    feed_metadata = {k: v for k, v in feed_metadata.items() if v}
 
-    transact_items = [
-        {
-            "Put": {
-                "TableName": TABLE_NAME,
-                "Item": {
-                    "PK": unique_pk,
-                    "SK": unique_sk,
-                },
-                "ConditionExpression": "attribute_not_exists(PK) AND attribute_not_exists(SK)",
-            }
-        },
-        {
-            "Put": {
-                "TableName": TABLE_NAME,
-                "Item": {
-                    "PK": pk_value,
-                    "SK": sk_value,
-                    **feed_metadata,
-                },
-            }
-        },
-    ]
+def remember_url(feed_url: str):
+    """Record that a feed with the given URL is stored"""
+    _seen_urls[feed_url] = None
+    _seen_urls.move_to_end(feed_url)
+    if len(_seen_urls) > SEEN_URLS_MAX:
+        _seen_urls.popitem(last=False)
+
 
-    dynamodb_client.transact_write_items(TransactItems=transact_items)
+def feed_exists_response(feed_url: str) -> dict:
+    """Response to adding a feed whose URL is already taken"""
+    return {
+        "statusCode": 400,
+        "body": json_dumps({"message": f"A feed with URL {feed_url} already exists!"}),
+    }
 
 
 @app.post("/feeds")
@@ -178,36 +222,65 @@ def create_feed() -> dict:
         raise InputValidationError(exc.errors()) from exc
 
     feed_url = str(feed_input.feed_url)
-    feed_data = feedparser.parse(feed_url)
 
-    if feed_data.bozo:
-        return {"statusCode": 400, "body": json.dumps({"message": "Invalid feed URL"})}
+    # Retried requests for a feed this container just added skip the download
+    # and the conditional write
+    if feed_url in _seen_urls:
+        _seen_urls.move_to_end(feed_url)
+        return feed_exists_response(feed_url)
+
+    # Download through the layer's pooled connections so warm invocations
+    # reuse them, feedparser only parses the document. The channel metadata
+    # comes before the entries, so a large feed is only read up to its head.
+    response = fetch_feed(feed_url, max_bytes=FEED_HEAD_BYTES)
+    if response is None:
+        return {"statusCode": 400, "body": json_dumps({"message": "Invalid feed URL"})}
+
+    # Hand over the headers feedparser would have seen so it detects the
+    # encoding and resolves relative links the same way
+    response_headers = {"content-location": feed_url}
+    if response.content_type:
+        response_headers["content-type"] = response.content_type
+    # Only the channel metadata is stored, so skip sanitizing and rewriting the
+    # links inside the entries' HTML, which is most of feedparser's work
+    feed_data = load_feedparser().parse(
+        response.body,
+        response_headers=response_headers,
+        sanitize_html=False,
+        resolve_relative_uris=False,
+    )
+
+    # A cut off document is never well-formed, accept it if its head parsed
+    if feed_data.bozo and not (
+        response.truncated and feed_data.version and feed_data.feed.get("title")
+    ):
+        return {"statusCode": 400, "body": json_dumps({"message": "Invalid feed URL"})}
 
     # Extract necessary metadata from the parsed feed
     try:
         store_feed_metadata(feed_url, feed_data)
     except PydanticValidationError as exc:
         raise FeedValidationError(exc.errors()) from exc
-    except ClientError as exc:
-        if exc.response["Error"]["Code"] == "TransactionCanceledException":
-            # One of the conditions failed (likely the uniqueness check)
-            return {
-                "statusCode": 400,
-                "body": json.dumps(
-                    {
-                        "message": f"A feed with URL {feed_url} already exists or another condition failed!"
-                    }
-                ),
-            }
-
+    except (ClientError, BotoCoreError) as exc:
+        if (
+            isinstance(exc, ClientError)
+            and exc.response["Error"]["Code"] == "ConditionalCheckFailedException"
+        ):
+            # The uniqueness check failed
+            remember_url(feed_url)
+            return feed_exists_response(feed_url)
+
+        # Any other DynamoDB error, including connection errors and timeouts
         return {
             "statusCode": 500,
-            "body": json.dumps({"message": "Internal server error"}),
+            "body": json_dumps({"message": "Internal server error"}),
         }
 
+    remember_url(feed_url)
+
     return {
         "statusCode": 200,
-        "body": json.dumps({"message": "Feed added successfully"}),
+        "body": json_dumps({"message": "Feed added successfully"}),
     }
 
 
@@ -1,10 +1,9 @@
 """ Model for add_feed lambda function """
 
 from enum import Enum
-from typing import Optional
+from typing import Optional, TypedDict
 from aws_lambda_powertools.utilities.parser.pydantic import (
     BaseModel,
-    ConfigDict,
     HttpUrl,
     field_serializer,
 )
@@ -17,16 +16,17 @@ class FeedStatus(str, Enum):
     INACTIVE = "inactive"
 
 
-class Feed(BaseModel):
+# Feed and FeedItem describe items built from trusted data, so they are plain
+# TypedDicts rather than validated models. Empty attributes aren't stored,
+# hence total=False.
+class Feed(TypedDict, total=False):
     """Feed model"""
 
-    model_config = ConfigDict()
-
     feed_id: Optional[str]
-    feed_url: HttpUrl
+    feed_url: str
     feed_atom_id: Optional[str]  # Atom's feed id
     feed_title: str
-    feed_link: Optional[HttpUrl]
+    feed_link: Optional[str]
     feed_description: Optional[str]
     feed_author: Optional[str]
     feed_language: Optional[str]
@@ -34,7 +34,7 @@ class Feed(BaseModel):
     feed_last_build_date: Optional[str]  # RSS's lastBuildDate
     feed_updated: Optional[str]  # Atom's updated field
     feed_ttl: Optional[int]
-    feed_image: Optional[HttpUrl]
+    feed_image: Optional[str]
     last_polled: str
     update_period: str
     update_frequency: str
@@ -42,47 +42,26 @@ class Feed(BaseModel):
     error_count: int
     last_error_message: Optional[str]
     push_supported: bool
-    push_hub_url: Optional[HttpUrl]
-    push_topic_url: Optional[HttpUrl]
+    push_hub_url: Optional[str]
+    push_topic_url: Optional[str]
     push_last_subscription: Optional[str]
     categories: Optional[list[str]]  # Categories or tags
     version: str  # Directly storing the feed version provided by feedparser
 
-    @field_serializer(
-        "feed_url",
-        "feed_link",
-        "feed_image",
-        "push_hub_url",
-        "push_topic_url",
-    )
-    def serialize_url(self, value: HttpUrl) -> str:
-        """Convert url to string."""
-        return str(value) if value else value
-
 
-class FeedItem(BaseModel):
+class FeedItem(TypedDict, total=False):
     """Feed item model"""
 
-    model_config = ConfigDict()
-
     item_id: str  # This will be the GUID (RSS), ID (Atom), or LINK
     title: str
     description: Optional[str]
-    link: HttpUrl
+    link: str
     author: Optional[str]
     published: Optional[str]
     updated: Optional[str]
     content: Optional[str]
     categories: Optional[list[str]]
-    comments_link: Optional[HttpUrl]
-
-    @field_serializer(
-        "link",
-        "comments_link",
-    )
-    def serialize_url(self, value: HttpUrl) -> str:
-        """Convert url to string."""
-        return str(value) if value else value
+    comments_link: Optional[str]
 
 
 class CreateFeedInput(BaseModel):
@@ -96,7 +75,7 @@ class CreateFeedInput(BaseModel):
         return str(value) if value else value
 
 
-class FeedListResponse(BaseModel):
+class FeedListResponse(TypedDict):
     """Response for list_feeds"""
 
     feeds: list[Feed]
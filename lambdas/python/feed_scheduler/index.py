@@ -1,29 +1,55 @@
 """ Lambda handler for feed_scheduler """
-# pylint: disable=unused-argument
+# pylint: disable=unused-argument, import-error
 
-from datetime import datetime, timedelta
-import os
-import json
+from concurrent.futures import as_completed
+import time
 
+from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.data_classes import event_source, EventBridgeEvent
 from aws_lambda_powertools.utilities.typing import LambdaContext
-import boto3
+
+from feed_common import (
+    POLL_INDEX,
+    POLL_SHARDS,
+    TABLE_NAME,
+    dynamodb_client,
+    executor,
+    feed_message_body,
+    send_feed_messages,
+)
+
+logger = Logger()
+
+
+def due_feeds(shard: int, now: int):
+    """Yield the feeds of a PollIndex shard whose next poll is due"""
+    pages = dynamodb_client.get_paginator("query").paginate(
+        TableName=TABLE_NAME,
+        IndexName=POLL_INDEX,
+        KeyConditionExpression="poll_shard = :shard AND next_poll_ts <= :now",
+        ExpressionAttributeValues={
+            ":shard": {"N": str(shard)},
+            ":now": {"N": str(now)},
+        },
+        ProjectionExpression="feed_id, feed_url",
+    )
+    for page in pages:
+        yield from page["Items"]
 
 
-# Initialize DynamoDB and SQS clients
-dynamodb = boto3.resource("dynamodb")
-sqs = boto3.resource("sqs")
+def schedule_shard(shard: int, now: int) -> int:
+    """Queue the due feeds of a PollIndex shard, returns how many were queued"""
+    message_bodies = [
+        feed_message_body(item["feed_id"]["S"], item["feed_url"]["S"])
+        for item in due_feeds(shard, now)
+    ]
 
-# References to the DynamoDB table and SQS queue
-TABLE_NAME = os.environ["TABLE_NAME"]
-QUEUE_URL = os.environ["QUEUE_URL"]
+    failed = send_feed_messages(message_bodies)
+    if failed:
+        # next_poll_ts wasn't moved forward, so these are picked up on the next run
+        logger.error("Failed to queue %d feeds: %s", len(failed), failed)
 
-PERIOD_TO_SECONDS = {
-    "hourly": 3600,
-    "daily": 86400,
-    "weekly": 604800,
-    "monthly": 2592000,
-}
+    return len(message_bodies) - len(failed)
 
 
 # pylint: disable=no-value-for-parameter
@@ -31,54 +57,14 @@ PERIOD_TO_SECONDS = {
 def handler(event: EventBridgeEvent, context: LambdaContext):
     """Lambda handler for feed_scheduler"""
 
-    # Reference to the DynamoDB table
-    table = dynamodb.Table(TABLE_NAME)
-
-    # Reference to the SQS queue using Queue URL
-    queue = sqs.Queue(QUEUE_URL)
-
-    # Scan the DynamoDB table for records matching the keys pattern
-    response = table.scan(
-        FilterExpression="begins_with(#pk, :pk) AND begins_with(#sk, :sk)",
-        ExpressionAttributeNames={"#pk": "PK", "#sk": "SK"},
-        ExpressionAttributeValues={":pk": "FEED#", ":sk": "META#"},
-    )
-
-    print(f"Found {response} feeds to schedule")
-
-    # Iterate over the records
-    for item in response["Items"]:
-        print(f"Processing {item}")
-
-        feed_id = item["PK"].split("#")[1]
-        feed_url = item["feed_url"]
-
-        last_polled = datetime.strptime(item["last_polled"], "%Y-%m-%dT%H:%M:%S.%f")
-
-        # Get the update_period and update_frequency values
-        update_period = item.get(
-            "update_period", "hourly"
-        )  # Default to 'daily' if not present
-        update_frequency = int(
-            item.get("update_frequency", 1)
-        )  # Default to 1 if not present
-
-        # Calculate polling interval in seconds
-        polling_interval = PERIOD_TO_SECONDS.get(update_period, 3600) * update_frequency
-
-        # Calculate the next polling time
-        next_polled = last_polled + timedelta(seconds=polling_interval)
+    # next_poll_ts is kept up to date when the feed is stored or polled, so
+    # the index only returns the feeds that are due
+    now = int(time.time())
 
-        # Get the current time
-        current_time = datetime.utcnow()
+    # The shards are independent, so their queries and sends overlap
+    futures = [
+        executor.submit(schedule_shard, shard, now) for shard in range(POLL_SHARDS)
+    ]
+    scheduled = sum(future.result() for future in as_completed(futures))
 
-        # If the next polling time is in the past, add the feed to the SQS queue
-        if current_time >= next_polled:
-            message_body = json.dumps(
-                {
-                    "feed_id": feed_id,
-                    "feed_url": feed_url,
-                }
-            )
-            queue.send_message(MessageBody=message_body)
-            print(f"Added {feed_id} to SQS queue for fetching feed items")
+    logger.debug("Scheduled %d feeds", scheduled)
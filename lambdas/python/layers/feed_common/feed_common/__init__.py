@@ -0,0 +1,46 @@
+""" Helpers shared by the feed lambdas, deployed as the feed_common layer """
+
+from .clients import (
+    QUEUE_URL,
+    TABLE_NAME,
+    boto_config,
+    dynamodb_client,
+    executor,
+    sqs_client,
+)
+from .items import (
+    BatchWriteError,
+    chunk,
+    get_cache_validators,
+    parse_date,
+    store_feed_items,
+    update_feed_on_error,
+    update_feed_on_success,
+)
+from .keys import (
+    FEED_PK,
+    FEED_PREFIX,
+    ITEM_SK,
+    META_PREFIX,
+    META_SK,
+    UNIQUE_URL,
+    feed_meta_key,
+)
+from .messages import send_feed_messages
+from .parser import (
+    FeedParseError,
+    FeedResponse,
+    fetch_feed,
+    fetch_feeds,
+    load_feedparser,
+    parse_entries,
+)
+from .schedule import (
+    DEFAULT_UPDATE_PERIOD,
+    PERIOD_TO_SECONDS,
+    POLL_INDEX,
+    POLL_SHARDS,
+    poll_shard,
+    polling_interval,
+)
+from .serialization import feed_message_body, json_dumps, json_loads
@@ -0,0 +1,58 @@
+""" Shared AWS clients for the feed lambdas """
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import os
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+TABLE_NAME = os.environ["TABLE_NAME"]
+
+# Sized so the concurrent batch calls never wait on a pooled connection, with
+# keep-alive so warm invocations reuse them. botocore's 60 second timeouts
+# would outlast the functions' 10 second timeout, so a stalled call is failed
+# and retried well before that.
+boto_config = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 10},
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=5,
+)
+
+# Longest the Lambda init phase waits on the connection warm-up
+WARM_UP_TIMEOUT = 2
+
+# Initialize DynamoDB client
+dynamodb_client = boto3.client("dynamodb", config=boto_config)
+
+# Only the functions that queue feeds for fetching are given the queue
+QUEUE_URL = os.environ.get("QUEUE_URL")
+sqs_client = boto3.client("sqs", config=boto_config) if QUEUE_URL else None
+
+# Reused across warm invocations to issue network calls concurrently
+executor = ThreadPoolExecutor(max_workers=8)
+
+
+def warm_up():
+    """Open the DynamoDB and SQS connections, so the first request doesn't pay
+    the endpoint resolution and TLS handshake. Any response, even an error,
+    leaves a warm connection in the pool."""
+    try:
+        dynamodb_client.describe_endpoints()
+        if sqs_client:
+            sqs_client.get_queue_attributes(
+                QueueUrl=QUEUE_URL, AttributeNames=["QueueArn"]
+            )
+    except (BotoCoreError, ClientError):
+        pass
+
+
+# Warm up during the Lambda init phase. The call is retried like any other, so
+# only wait on it briefly rather than let a slow endpoint hold up the init.
+if os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+    try:
+        executor.submit(warm_up).result(timeout=WARM_UP_TIMEOUT)
+    except FutureTimeoutError:
+        pass
@@ -0,0 +1,326 @@
+""" Helpers to store feeds and feed items in DynamoDB """
+
+from collections import OrderedDict
+from concurrent.futures import as_completed
+import hashlib
+import random
+import time
+
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
+from dateutil import parser as date_parser, tz
+import orjson
+
+from .clients import TABLE_NAME, dynamodb_client, executor
+from .keys import FEED_PK, FEED_PREFIX, ITEM_SK, feed_meta_key
+from .schedule import DEFAULT_UPDATE_PERIOD, polling_interval
+
+BATCH_GET_SIZE = 100  # BatchGetItem limit
+BATCH_WRITE_SIZE = 25  # BatchWriteItem limit
+
+logger = Logger(child=True)
+
+# Number of stored item hashes remembered by a warm container
+SEEN_ITEMS_MAX = 4096
+
+# Exponential backoff for throttled or partially processed batch writes
+WRITE_MAX_ATTEMPTS = 8
+WRITE_BACKOFF_BASE = 0.05
+WRITE_BACKOFF_CAP = 1.0
+
+# Interval of the feeds stored before poll_interval was recorded
+DEFAULT_POLL_INTERVAL = polling_interval(DEFAULT_UPDATE_PERIOD, 1)
+
+# Due time of the next poll, computed from the interval stored with the feed.
+# Feeds stored before the PollIndex existed are added to it by
+# scripts/backfill_poll_index.py, which derives their interval from their hints.
+NEXT_POLL_EXPRESSION = (
+    "next_poll_ts = if_not_exists(poll_interval, :default_interval) + :now_ts"
+)
+
+# RFC 822 timezone abbreviations commonly found in RSS dates
+TZINFOS = {
+    "EST": tz.tzoffset("EST", -5 * 3600),
+    "EDT": tz.tzoffset("EDT", -4 * 3600),
+    "CST": tz.tzoffset("CST", -6 * 3600),
+    "CDT": tz.tzoffset("CDT", -5 * 3600),
+    "MST": tz.tzoffset("MST", -7 * 3600),
+    "MDT": tz.tzoffset("MDT", -6 * 3600),
+    "PST": tz.tzoffset("PST", -8 * 3600),
+    "PDT": tz.tzoffset("PDT", -7 * 3600),
+}
+
+_date_parser = date_parser.parser()
+
+# (PK, SK) -> content_hash of items known to be stored, least recently used first
+_seen_items = OrderedDict()
+
+
+class BatchWriteError(Exception):
+    """Raised when a batch write still has unprocessed items after all retries"""
+
+
+def resolve_tzinfo(tzname, tzoffset):
+    """tzinfos callback for dateutil, raises ValueError on an unknown timezone
+    name rather than letting the date come back naive"""
+    if tzname in TZINFOS:
+        return TZINFOS[tzname]
+    if tzoffset == 0:
+        return tz.UTC
+    if tzoffset is not None:
+        return tz.tzoffset(tzname, tzoffset)
+    if tzname:
+        raise ValueError(f"Unknown timezone {tzname}")
+    return None
+
+
+def parse_date(value):
+    """Normalize a feed date string to ISO-8601, keeping the original string if
+    it can't be parsed"""
+    if not value:
+        return None
+    try:
+        parsed = _date_parser.parse(value, tzinfos=resolve_tzinfo)
+    except (ValueError, OverflowError):
+        return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tz.UTC)
+    return parsed.isoformat()
+
+
+def chunk(items, batch_size):
+    """Yield successive batch_size-sized chunks from items."""
+    for i in range(0, len(items), batch_size):
+        yield items[i : i + batch_size]
+
+
+def update_feed_on_success(
+    feed_id: str, current_time: str, etag: str = None, modified: str = None
+):
+    """Reset error_count and last_error_message on successful update, and update
+    last_polled, next_poll_ts and the HTTP cache validators returned with the feed"""
+    update_expression = (
+        "SET error_count = :zero, last_error_message = :empty_str, "
+        "last_polled = :current_time, " + NEXT_POLL_EXPRESSION
+    )
+    expression_attribute_values = {
+        ":zero": {"N": "0"},
+        ":empty_str": {"S": ""},
+        ":current_time": {"S": current_time},
+        ":default_interval": {"N": str(DEFAULT_POLL_INTERVAL)},
+        ":now_ts": {"N": str(int(time.time()))},
+    }
+    if etag:
+        update_expression += ", etag = :etag"
+        expression_attribute_values[":etag"] = {"S": etag}
+    if modified:
+        update_expression += ", modified = :modified"
+        expression_attribute_values[":modified"] = {"S": modified}
+
+    dynamodb_client.update_item(
+        TableName=TABLE_NAME,
+        Key=feed_meta_key(feed_id),
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=expression_attribute_values,
+    )
+
+
+def update_feed_on_error(feed_id: str, error_message: str, current_time: str):
+    """Increment error_count, set last_error_message, and update last_polled and
+    next_poll_ts on update error"""
+    dynamodb_client.update_item(
+        TableName=TABLE_NAME,
+        Key=feed_meta_key(feed_id),
+        UpdateExpression=(
+            "ADD error_count :one SET last_error_message = :error_msg, "
+            "last_polled = :current_time, " + NEXT_POLL_EXPRESSION
+        ),
+        ExpressionAttributeValues={
+            ":one": {"N": "1"},
+            ":error_msg": {"S": error_message},
+            ":current_time": {"S": current_time},
+            ":default_interval": {"N": str(DEFAULT_POLL_INTERVAL)},
+            ":now_ts": {"N": str(int(time.time()))},
+        },
+    )
+
+
+def get_cache_validators(feed_ids: list) -> dict:
+    """Fetch the ETag and Last-Modified values stored for each feed, keyed by
+    feed id"""
+    if not feed_ids:
+        return {}
+
+    keys = [feed_meta_key(feed_id) for feed_id in set(feed_ids)]
+    validators = {}
+    for batch in chunk(keys, BATCH_GET_SIZE):
+        response = dynamodb_client.batch_get_item(
+            RequestItems={
+                TABLE_NAME: {
+                    "Keys": batch,
+                    "ProjectionExpression": "PK, etag, modified",
+                }
+            }
+        )
+        for item in response["Responses"].get(TABLE_NAME, []):
+            validators[item["PK"]["S"][len(FEED_PREFIX) :]] = (
+                item.get("etag", {}).get("S"),
+                item.get("modified", {}).get("S"),
+            )
+    return validators
+
+
+def remember_item(key: tuple, digest: str):
+    """Record that the item with the given key is stored with the given hash"""
+    _seen_items[key] = digest
+    _seen_items.move_to_end(key)
+    if len(_seen_items) > SEEN_ITEMS_MAX:
+        _seen_items.popitem(last=False)
+
+
+def content_hash(item: dict) -> str:
+    """Digest of an item's attributes, used to detect changed feed items"""
+    payload = orjson.dumps(item, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def get_batch(keys: list) -> list:
+    """Fetch the keys and content hash of a single BatchGetItem page of items"""
+    response = dynamodb_client.batch_get_item(
+        RequestItems={
+            TABLE_NAME: {"Keys": keys, "ProjectionExpression": "PK, SK, content_hash"}
+        }
+    )
+    return response["Responses"].get(TABLE_NAME, [])
+
+
+def write_batch(items: list):
+    """Write a single BatchWriteItem page of items, retrying unprocessed items
+    with exponential backoff and full jitter until DynamoDB accepts all of them"""
+    request_items = {TABLE_NAME: [{"PutRequest": {"Item": item}} for item in items]}
+
+    for attempt in range(WRITE_MAX_ATTEMPTS):
+        try:
+            response = dynamodb_client.batch_write_item(RequestItems=request_items)
+            request_items = response.get("UnprocessedItems")
+        except ClientError as exc:
+            if (
+                exc.response["Error"]["Code"]
+                != "ProvisionedThroughputExceededException"
+            ):
+                raise
+            # The whole batch was throttled, re-send it as is
+
+        if not request_items:
+            return
+
+        time.sleep(
+            random.uniform(0, min(WRITE_BACKOFF_CAP, WRITE_BACKOFF_BASE * 2**attempt))
+        )
+
+    raise BatchWriteError(
+        f"{len(request_items[TABLE_NAME])} items unprocessed after "
+        f"{WRITE_MAX_ATTEMPTS} attempts"
+    )
+
+
+def store_feed_items(feed_id: str, entries: list):
+    """Store feed items in DynamoDB"""
+
+    feed_items = []
+    items_to_check_keys = []
+
+    # Every item of the feed shares the same partition key
+    item_pk = {"S": FEED_PK(feed_id)}
+
+    for entry in entries:
+        # Items are identified by their GUID (RSS), ID (Atom), or LINK
+        item_id = entry.get("guid") or entry.get("id") or entry.get("link")
+        if not item_id:
+            continue
+        item_sk = {"S": ITEM_SK(item_id)}
+
+        # Extract categories or tags
+        # Sorted so the content hash doesn't depend on set ordering
+        categories = sorted({tag.get("term") for tag in entry.get("tags", [])} - {None})
+
+        # Extract comments link
+        comments_link = entry.get("comments", None)
+        if not comments_link:
+            comments_links = [
+                link.get("href")
+                for link in entry.get("links", [])
+                if link.get("rel") == "replies"
+            ]
+            comments_link = comments_links[0] if comments_links else None
+
+        published = parse_date(entry.get("published"))
+        updated = parse_date(entry.get("updated"))
+
+        # Only keep the attributes that have a value
+        feed_item = {"PK": item_pk, "SK": item_sk}
+        for name, value in (
+            ("title", entry.get("title")),
+            ("link", entry.get("link")),
+            ("description", entry.get("description")),
+            ("author", entry.get("author")),
+            ("published", published),
+            ("updated", updated),
+            ("content", entry.get("content")),
+            ("comments_link", comments_link),
+        ):
+            if value:
+                feed_item[name] = {"S": str(value)}
+        if categories:
+            feed_item["categories"] = {"SS": categories}
+
+        digest = content_hash(feed_item)
+
+        # Skip items this container already stored unchanged, without reading them
+        key = (item_pk["S"], item_sk["S"])
+        if _seen_items.get(key) == digest:
+            _seen_items.move_to_end(key)
+            continue
+
+        feed_item["content_hash"] = {"S": digest}
+        feed_items.append(feed_item)
+
+        # Add the item to the list of items to check for keys
+        items_to_check_keys.append({"PK": item_pk, "SK": item_sk})
+
+    # Batch get existing feed items from DynamoDB for comparison using the client interface
+    fetched_items_dict = {}
+    batch_keys = [{"PK": key["PK"], "SK": key["SK"]} for key in items_to_check_keys]
+    futures = [
+        executor.submit(get_batch, keys) for keys in chunk(batch_keys, BATCH_GET_SIZE)
+    ]
+    for future in as_completed(futures):
+        for item in future.result():
+            fetched_items_dict[(item["PK"]["S"], item["SK"]["S"])] = item
+
+    # Filter items to only those that are new or have changed
+    items_to_write = []
+    for item in feed_items:
+        key = (item["PK"]["S"], item["SK"]["S"])
+        existing_item = fetched_items_dict.get(key, None)
+        if (
+            not existing_item
+            or existing_item.get("content_hash") != item["content_hash"]
+        ):
+            items_to_write.append(item)
+        else:
+            remember_item(key, item["content_hash"]["S"])
+
+    logger.debug(
+        "Feed %s: %d existing items, %d items to write",
+        feed_id,
+        len(fetched_items_dict),
+        len(items_to_write),
+    )
+
+    # Batch write the new or changed items to DynamoDB concurrently. Consuming
+    # the results re-raises any error from the worker threads.
+    list(executor.map(write_batch, chunk(items_to_write, BATCH_WRITE_SIZE)))
+
+    for item in items_to_write:
+        remember_item((item["PK"]["S"], item["SK"]["S"]), item["content_hash"]["S"])
@@ -0,0 +1,17 @@
+""" Key schema of the feed table """
+
+FEED_PREFIX = "FEED#"
+META_PREFIX = "META#"
+ITEM_PREFIX = "ITEM#"
+UNIQUE_URL_PREFIX = "UNIQUE#FEED_URL#"
+
+# Formatters for the PK/SK values, e.g. FEED_PK(feed_id) == "FEED#<feed_id>"
+FEED_PK = (FEED_PREFIX + "{}").format
+META_SK = (META_PREFIX + "{}").format
+ITEM_SK = (ITEM_PREFIX + "{}").format
+UNIQUE_URL = (UNIQUE_URL_PREFIX + "{}").format
+
+
+def feed_meta_key(feed_id: str) -> dict:
+    """Primary key of a feed's metadata row"""
+    return {"PK": {"S": FEED_PK(feed_id)}, "SK": {"S": META_SK(feed_id)}}
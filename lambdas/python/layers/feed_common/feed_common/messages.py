@@ -0,0 +1,32 @@
+""" Helpers to queue feeds for fetching in SQS """
+
+from .clients import QUEUE_URL, sqs_client
+from .items import chunk
+
+SQS_BATCH_SIZE = 10  # SendMessageBatch limit
+SEND_MAX_ATTEMPTS = 3
+
+
+def send_feed_messages(message_bodies: list) -> list:
+    """Queue feed messages with batched SendMessageBatch calls, retrying the
+    entries SQS failed to enqueue. Returns the failures left after the last
+    attempt."""
+    failed = []
+    for batch in chunk(message_bodies, SQS_BATCH_SIZE):
+        entries = [
+            {"Id": str(index), "MessageBody": message_body}
+            for index, message_body in enumerate(batch)
+        ]
+        for _ in range(SEND_MAX_ATTEMPTS):
+            response = sqs_client.send_message_batch(
+                QueueUrl=QUEUE_URL, Entries=entries
+            )
+            failures = response.get("Failed", [])
+            if not failures:
+                break
+            failed_ids = {failure["Id"] for failure in failures}
+            entries = [entry for entry in entries if entry["Id"] in failed_ids]
+
+        failed.extend(failures)
+
+    return failed
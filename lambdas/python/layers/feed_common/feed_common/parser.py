@@ -0,0 +1,299 @@
+""" Streaming RSS/Atom parser for feed entries """
+
+from functools import lru_cache
+import io
+import re
+from typing import NamedTuple, Optional
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from aws_lambda_powertools import Logger
+import urllib3
+
+from .clients import executor
+
+logger = Logger(child=True)
+
+FETCH_TIMEOUT = 5
+USER_AGENT = "news-aggregator-cdk/0.1 (+feed_common)"
+
+# Size of the reads when only the head of a feed document is downloaded
+HEAD_CHUNK_BYTES = 64 * 1024
+
+# Kept across warm invocations so feed hosts reuse their keep-alive connections
+http = urllib3.PoolManager(
+    maxsize=10,
+    timeout=urllib3.Timeout(connect=FETCH_TIMEOUT, read=FETCH_TIMEOUT),
+    headers={"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"},
+)
+
+# The root element of an Atom feed is always within the first couple of KB
+SNIFF_BYTES = 2048
+ATOM_ROOT = re.compile(rb"<(?:[\w.-]+:)?feed[\s>]")
+
+# Element local names mapped to the entry keys feedparser would produce
+RSS_FIELDS = {
+    "title": "title",
+    "link": "link",
+    "description": "description",
+    "encoded": "content",  # content:encoded
+    "author": "author",
+    "creator": "author",  # dc:creator
+    "pubDate": "published",
+    "date": "published",  # dc:date, used by RSS 1.0
+    "guid": "guid",
+    "comments": "comments",
+}
+ATOM_FIELDS = {
+    "title": "title",
+    "summary": "description",
+    "content": "content",
+    "published": "published",
+    "updated": "updated",
+    "id": "id",
+}
+
+
+class FeedParseError(Exception):
+    """Raised when a document cannot be parsed as an RSS or Atom feed"""
+
+
+class FeedResponse(NamedTuple):
+    """A downloaded feed document and the validators to fetch it conditionally"""
+
+    status: int
+    body: Optional[bytes]
+    etag: Optional[str]
+    modified: Optional[str]
+    content_type: Optional[str] = None
+    truncated: bool = False  # body was cut off at fetch_feed's max_bytes
+
+    @property
+    def not_modified(self) -> bool:
+        """Whether the feed hasn't changed since the validators were issued"""
+        return self.status == 304
+
+
+@lru_cache(maxsize=None)
+def load_feedparser():
+    """Import feedparser on first use, so handlers that never parse a whole
+    feed with it don't pay its import on cold start"""
+    # pylint: disable=import-outside-toplevel
+    import feedparser
+
+    return feedparser
+
+
+def _local_name(tag: str) -> str:
+    """Strip the namespace from an ElementTree tag"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _element_text(element: ElementTree.Element):
+    """Return the stripped text content of an element, or None if empty"""
+    text = "".join(element.itertext()).strip()
+    return text or None
+
+
+def _strip_namespaces(element: ElementTree.Element):
+    """Drop the XML namespaces from the tags and attributes of a subtree"""
+    for node in element.iter():
+        node.tag = _local_name(node.tag)
+        for name in [name for name in node.attrib if name.startswith("{")]:
+            node.attrib[_local_name(name)] = node.attrib.pop(name)
+
+
+def _construct_text(element: ElementTree.Element):
+    """Return the value of an Atom text construct, or None if empty. The markup
+    of an xhtml construct is kept, serialized from inside its wrapper div."""
+    if element.get("type") != "xhtml":
+        return _element_text(element)
+
+    # The div is only required to wrap the markup, don't insist on it
+    wrapper = next(iter(element), None)
+    if wrapper is None or _local_name(wrapper.tag) != "div":
+        wrapper = element
+
+    _strip_namespaces(wrapper)
+    markup = escape(wrapper.text or "") + "".join(
+        ElementTree.tostring(child, encoding="unicode") for child in wrapper
+    )
+    return markup.strip() or None
+
+
+def _parse_rss_item(element: ElementTree.Element) -> dict:
+    """Normalize an RSS <item> element into an entry dict"""
+    entry = {"tags": [], "links": []}
+
+    for child in element:
+        name = _local_name(child.tag)
+
+        if name == "category":
+            term = _element_text(child)
+            if term:
+                entry["tags"].append({"term": term})
+        elif name in RSS_FIELDS:
+            value = _element_text(child)
+            if value:
+                entry.setdefault(RSS_FIELDS[name], value)
+
+    return entry
+
+
+def _parse_atom_entry(element: ElementTree.Element) -> dict:
+    """Normalize an Atom <entry> element into an entry dict"""
+    entry = {"tags": [], "links": []}
+
+    for child in element:
+        name = _local_name(child.tag)
+
+        if name == "link":
+            href = child.get("href")
+            if href:
+                rel = child.get("rel", "alternate")
+                entry["links"].append({"rel": rel, "href": href})
+                if rel == "alternate":
+                    entry.setdefault("link", href)
+        elif name == "category":
+            term = child.get("term")
+            if term:
+                entry["tags"].append({"term": term})
+        elif name == "author":
+            # Authors are person constructs, only keep the name
+            author = child.find("{*}name")
+            value = _element_text(author) if author is not None else None
+            if value:
+                entry.setdefault("author", value)
+        elif name in ATOM_FIELDS:
+            value = _construct_text(child)
+            if value:
+                entry.setdefault(ATOM_FIELDS[name], value)
+
+    return entry
+
+
+# Feed format -> (root element names, entry element name, entry parser)
+FEED_FORMATS = {
+    "rss": ({"rss", "RDF"}, "item", _parse_rss_item),
+    "atom": ({"feed"}, "entry", _parse_atom_entry),
+}
+
+
+def sniff_format(body: bytes) -> str:
+    """Tell an Atom feed from an RSS feed by looking at the start of the document"""
+    return "atom" if ATOM_ROOT.search(body, 0, SNIFF_BYTES) else "rss"
+
+
+def read_head(response, max_bytes: int):
+    """Read at most max_bytes of a streamed response's decoded body, returns the
+    body and whether it was cut off"""
+    chunks = []
+    size = 0
+    # Counts the decoded bytes, in case the server compresses the body anyway
+    for data in response.stream(HEAD_CHUNK_BYTES):
+        chunks.append(data)
+        size += len(data)
+        if size > max_bytes:
+            break
+
+    truncated = size > max_bytes
+    if truncated:
+        # Don't hand a connection with an unread body back to the pool
+        response.close()
+    response.release_conn()
+
+    return b"".join(chunks)[:max_bytes], truncated
+
+
+def fetch_feed(
+    feed_url: str, etag: str = None, modified: str = None, max_bytes: int = None
+):
+    """Download a feed document, conditionally if validators from a previous
+    download are given. With max_bytes, only that much of the body is read.
+    Returns None if the feed can't be fetched."""
+    headers = dict(http.headers)
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+    if max_bytes is not None:
+        # Have max_bytes bound the document itself rather than its compressed size
+        headers["Accept-Encoding"] = "identity"
+
+    try:
+        response = http.request(
+            "GET", feed_url, headers=headers, preload_content=max_bytes is None
+        )
+        if max_bytes is None:
+            body, truncated = response.data, False
+        else:
+            body, truncated = read_head(response, max_bytes)
+    except urllib3.exceptions.HTTPError as exc:
+        logger.warning("Failed to fetch %s: %s", feed_url, exc)
+        return None
+
+    if response.status not in (200, 304):
+        logger.warning("Failed to fetch %s: HTTP %d", feed_url, response.status)
+        return None
+
+    return FeedResponse(
+        status=response.status,
+        body=body if response.status == 200 else None,
+        etag=response.headers.get("ETag", etag),
+        modified=response.headers.get("Last-Modified", modified),
+        content_type=response.headers.get("Content-Type"),
+        truncated=truncated,
+    )
+
+
+def fetch_feeds(feed_urls: list, validators: list = None) -> list:
+    """Download several feed documents concurrently, in the given order.
+    validators optionally holds the (etag, modified) pair of each feed."""
+    validators = validators or [(None, None)] * len(feed_urls)
+    return list(
+        executor.map(
+            lambda feed_url, validator: fetch_feed(feed_url, *validator),
+            feed_urls,
+            validators,
+        )
+    )
+
+
+def iter_entries(body: bytes):
+    """Incrementally parse a feed document, yielding one entry dict per item"""
+    root_tags, entry_tag, parse_element = FEED_FORMATS[sniff_format(body)]
+
+    root = None
+    for event, element in ElementTree.iterparse(
+        io.BytesIO(body), events=("start", "end")
+    ):
+        if root is None:
+            root = element
+            if _local_name(root.tag) not in root_tags:
+                raise FeedParseError(f"Unexpected root element {root.tag}")
+            continue
+
+        if event == "end" and _local_name(element.tag) == entry_tag:
+            yield parse_element(element)
+            # Drop the parsed subtree so memory stays flat across the feed
+            element.clear()
+
+
+def parse_entries(body: bytes):
+    """Parse feed entries, falling back to feedparser for documents that are
+    not well-formed XML. Returns None if the feed is missing or invalid."""
+    if body is None:
+        return None
+
+    try:
+        return list(iter_entries(body))
+    # expat rejects multi-byte (Shift_JIS, Big5, ...) and unknown encodings,
+    # which feedparser decodes itself
+    except (ElementTree.ParseError, FeedParseError, ValueError, LookupError) as exc:
+        logger.info("Streaming parse failed, falling back to feedparser: %s", exc)
+
+    feed_data = load_feedparser().parse(body)
+    if feed_data.bozo:
+        return None
+
+    return feed_data.entries
@@ -0,0 +1,32 @@
+""" Polling schedule of the feeds, indexed by the PollIndex GSI """
+
+import zlib
+
+POLL_INDEX = "PollIndex"
+
+# Number of PollIndex partitions the feeds are spread over
+POLL_SHARDS = 16
+
+DEFAULT_UPDATE_PERIOD = "hourly"
+
+PERIOD_TO_SECONDS = {
+    "hourly": 3600,
+    "daily": 86400,
+    "weekly": 604800,
+    "monthly": 2592000,
+}
+
+
+def poll_shard(feed_id: str) -> int:
+    """PollIndex partition of a feed"""
+    # crc32 rather than hash(), which is salted per interpreter
+    return zlib.crc32(feed_id.encode()) % POLL_SHARDS
+
+
+def polling_interval(update_period: str, update_frequency) -> int:
+    """Seconds between two polls of a feed with the given syndication hints"""
+    try:
+        frequency = int(update_frequency)
+    except (TypeError, ValueError):
+        frequency = 1
+    return PERIOD_TO_SECONDS.get(update_period, 3600) * frequency
@@ -0,0 +1,16 @@
+""" JSON helpers backed by orjson """
+
+import orjson
+
+json_loads = orjson.loads
+
+
+def json_dumps(value) -> str:
+    """Serialize value to a JSON string"""
+    return orjson.dumps(value).decode()
+
+
+def feed_message_body(feed_id: str, feed_url: str) -> str:
+    """JSON body of the message queueing a feed for fetching. The feed id is a
+    generated hex string, so only the URL needs escaping."""
+    return '{"feed_id":"%s","feed_url":%s}' % (feed_id, json_dumps(feed_url))
@@ -0,0 +1,54 @@
+""" Tests for the streaming feed entry parser """
+
+import os
+import unittest
+
+os.environ.setdefault("TABLE_NAME", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+# pylint: disable=wrong-import-position
+from feed_common.parser import parse_entries  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixture(name: str) -> bytes:
+    """Read a feed document from the fixtures directory"""
+    with open(os.path.join(FIXTURES, name), "rb") as fixture:
+        return fixture.read()
+
+
+class ParseEntriesTest(unittest.TestCase):
+    """parse_entries against what feedparser returns for the same documents"""
+
+    def test_atom_xhtml_constructs_keep_their_markup(self):
+        entry = parse_entries(load_fixture("atom_xhtml.xml"))[0]
+
+        self.assertEqual(entry["title"], "Less <em>than</em> 3")
+        self.assertEqual(
+            entry["content"],
+            '<p>Hello <a href="http://l">link</a> &amp; more</p>'
+            '<img src="http://i/x.png" alt="" />',
+        )
+
+    def test_atom_text_and_html_constructs(self):
+        first, second = parse_entries(load_fixture("atom_xhtml.xml"))
+
+        self.assertEqual(first["description"], "<b>Bold</b> summary")
+        self.assertEqual(second["title"], "Plain & simple")
+        self.assertEqual(second["content"], "Just text")
+        self.assertEqual(second["link"], "http://example.org/2")
+
+    def test_multi_byte_encoding_falls_back_to_feedparser(self):
+        entries = parse_entries(load_fixture("rss_shift_jis.xml"))
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["title"], "こんにちは")
+        self.assertEqual(entries[0]["link"], "http://example.jp/1")
+
+    def test_missing_body(self):
+        self.assertIsNone(parse_entries(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,6 +21,16 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
       removalPolicy: cdk.RemovalPolicy.DESTROY
     });
 
+    // Index the feeds by the time they are next due to be polled, spread over
+    // poll_shard partitions so the scheduler can query them by range
+    feedTable.addGlobalSecondaryIndex({
+      indexName: 'PollIndex',
+      partitionKey: { name: 'poll_shard', type: dynamodb.AttributeType.NUMBER },
+      sortKey: { name: 'next_poll_ts', type: dynamodb.AttributeType.NUMBER },
+      projectionType: dynamodb.ProjectionType.INCLUDE,
+      nonKeyAttributes: ['feed_id', 'feed_url']
+    });
+
     // Create the dead letter queue
     const feedDLQueue = new sqs.Queue(this, 'FeedDLQueue', {
       queueName: 'FeedDLQueue',
@@ -38,6 +48,26 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
       }
     });
 
+    // Create the layer with the helpers shared by the feed lambdas
+    const feedCommonLayer = new lambda.LayerVersion(this, 'FeedCommonLayer', {
+      description: 'Helpers shared by the feed lambdas',
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_10],
+      compatibleArchitectures: [lambda.Architecture.ARM_64],
+      code: lambda.Code.fromAsset(
+        path.join(__dirname, '../lambdas/python/layers/feed_common'),
+        {
+          bundling: {
+            image: lambda.Runtime.PYTHON_3_10.bundlingImage,
+            command: [
+              'bash',
+              '-c',
+              'pip install -r requirements.txt -t /asset-output/python && cp -au feed_common /asset-output/python'
+            ]
+          }
+        }
+      )
+    });
+
     // Create the FeedManager Lambda
     const feedManagerLambda = new lambda.Function(this, 'FeedManagerLambda', {
       description: 'Lambda function to manage feeds',
@@ -57,6 +87,7 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
         }
       ),
       architecture: lambda.Architecture.ARM_64,
+      layers: [feedCommonLayer],
       timeout: cdk.Duration.seconds(10),
       environment: {
         TABLE_NAME: feedTable.tableName
@@ -87,6 +118,7 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
         }
       ),
       architecture: lambda.Architecture.ARM_64,
+      layers: [feedCommonLayer],
       timeout: cdk.Duration.seconds(10),
       environment: {
         TABLE_NAME: feedTable.tableName,
@@ -94,6 +126,11 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
       }
     });
 
+    feedItemInitLambda.addEnvironment(
+      'POWERTOOLS_SERVICE_NAME',
+      'FeedItemInit'
+    );
+
     // Create the FeedItemFetcher Lambda
     const feedItemFetcherLambda = new lambda.Function(
       this,
@@ -116,6 +153,7 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
           }
         ),
         architecture: lambda.Architecture.ARM_64,
+        layers: [feedCommonLayer],
         timeout: cdk.Duration.seconds(10),
         environment: {
           TABLE_NAME: feedTable.tableName,
@@ -124,6 +162,11 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
       }
     );
 
+    feedItemFetcherLambda.addEnvironment(
+      'POWERTOOLS_SERVICE_NAME',
+      'FeedItemFetcher'
+    );
+
     // Create the FeedScheduler Lambda
     const feedSchedulerLambda = new lambda.Function(
       this,
@@ -146,6 +189,7 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
           }
         ),
         architecture: lambda.Architecture.ARM_64,
+        layers: [feedCommonLayer],
         timeout: cdk.Duration.seconds(10),
         environment: {
           TABLE_NAME: feedTable.tableName,
@@ -154,12 +198,18 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
       }
     );
 
+    feedSchedulerLambda.addEnvironment(
+      'POWERTOOLS_SERVICE_NAME',
+      'FeedScheduler'
+    );
+
     feedTable.grantReadWriteData(feedManagerLambda);
     feedTable.grantReadWriteData(feedItemInitLambda);
     feedTable.grantReadWriteData(feedItemFetcherLambda);
     feedTable.grantReadWriteData(feedSchedulerLambda);
 
     feedQueue.grantSendMessages(feedSchedulerLambda);
+    feedQueue.grantSendMessages(feedItemInitLambda);
 
     feedItemInitLambda.addEventSource(
       new eventsources.DynamoEventSource(feedTable, {
@@ -174,7 +224,11 @@ export class NewsAggregatorCdkStack extends cdk.Stack {
 
     feedItemFetcherLambda.addEventSource(
       new eventsources.SqsEventSource(feedQueue, {
-        batchSize: 10
+        batchSize: 10,
+        maxBatchingWindow: cdk.Duration.seconds(5),
+        reportBatchItemFailures: true,
+        // Bounds the concurrent writers to the table
+        maxConcurrency: 5
       })
     );
 
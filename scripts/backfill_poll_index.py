@@ -0,0 +1,96 @@
+""" One-off backfill of the PollIndex attributes of feeds stored before it existed
+
+Feeds without poll_shard are absent from the PollIndex GSI, so the scheduler
+never queues them. This sets feed_id, poll_shard, poll_interval and
+next_poll_ts on their metadata items, making them due on the next scheduler
+run. Re-running it only touches the feeds that are still missing poll_shard.
+
+Usage, with the layer requirements installed:
+
+    TABLE_NAME=<feed table> python scripts/backfill_poll_index.py
+"""
+
+import os
+import sys
+import time
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "lambdas",
+        "python",
+        "layers",
+        "feed_common",
+    ),
+)
+
+# pylint: disable=wrong-import-position
+from feed_common import (  # noqa: E402
+    DEFAULT_UPDATE_PERIOD,
+    META_PREFIX,
+    TABLE_NAME,
+    dynamodb_client,
+    poll_shard,
+    polling_interval,
+)
+
+
+def feeds_to_backfill():
+    """Yield the feed metadata items that have no poll_shard"""
+    pages = dynamodb_client.get_paginator("scan").paginate(
+        TableName=TABLE_NAME,
+        FilterExpression="begins_with(SK, :meta) AND attribute_not_exists(poll_shard)",
+        ExpressionAttributeValues={":meta": {"S": META_PREFIX}},
+        ProjectionExpression="PK, SK, update_period, update_frequency",
+    )
+    for page in pages:
+        yield from page["Items"]
+
+
+def backfill_feed(item: dict, now: int):
+    """Set the PollIndex attributes of a single feed metadata item"""
+    feed_id = item["SK"]["S"][len(META_PREFIX) :]
+    interval = polling_interval(
+        item.get("update_period", {}).get("S", DEFAULT_UPDATE_PERIOD),
+        item.get("update_frequency", {}).get("S", "1"),
+    )
+    dynamodb_client.update_item(
+        TableName=TABLE_NAME,
+        Key={"PK": item["PK"], "SK": item["SK"]},
+        UpdateExpression=(
+            "SET feed_id = if_not_exists(feed_id, :feed_id), "
+            "poll_shard = :shard, poll_interval = :interval, next_poll_ts = :now"
+        ),
+        # Skip the feeds already indexed since the scan, e.g. by a parallel run
+        ConditionExpression="attribute_exists(PK) AND attribute_not_exists(poll_shard)",
+        ExpressionAttributeValues={
+            ":feed_id": {"S": feed_id},
+            ":shard": {"N": str(poll_shard(feed_id))},
+            ":interval": {"N": str(interval)},
+            ":now": {"N": str(now)},
+        },
+    )
+
+
+def main():
+    """Backfill every feed missing from the PollIndex"""
+    now = int(time.time())
+    backfilled = 0
+    for item in feeds_to_backfill():
+        try:
+            backfill_feed(item, now)
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            continue
+        backfilled += 1
+
+    print(f"Backfilled {backfilled} feeds")
+
+
+if __name__ == "__main__":
+    main()